@@ -1,33 +1,394 @@
+import asyncio
+import atexit
+import hashlib
 import json
-import subprocess
-from ollama import chat, ChatResponse
-from typing import Dict, Any
+import os
+import re
+import shlex
+import shutil
+import tempfile
+import uuid
+import zipfile
+from base64 import b64encode
+from ollama import AsyncClient, ChatResponse, Message
+from typing import Dict, Any, List, Optional
+
+# Only needed by get_and_install_latest_build
+try:
+    import httpx
+    import h2  # noqa: F401 - HTTP/2 support for httpx
+except ImportError:
+    httpx = None
+
+# Only needed when talking to the device over ADB TCP without the adb binary
+try:
+    from adb_shell.adb_device_async import AdbDeviceTcpAsync
+    from adb_shell.auth.sign_pythonrsa import PythonRSASigner
+    from adb_shell.exceptions import AdbTimeoutError, TcpTimeoutException
+except ImportError:
+    AdbDeviceTcpAsync = None
 
 
 # ============= TOOL 1: Run ADB Commands =============
 
-def run_adb_command(command: str) -> Dict[str, Any]:
+class AdbShell:
+    """
+    Long-lived `adb shell` process that commands are fed to over stdin.
+
+    Every command is followed by an `echo` of a sentinel marker carrying its
+    exit code, so the output of one command can be told apart from the next
+    without paying adb startup and device connection cost on each call.
+    """
+
+    MARKER = "__END__"
+
+    def __init__(self):
+        self.process = None
+        # Whether the device shell writes stderr separately from stdout
+        self.split_stderr = True
+        # The shell runs one command at a time, concurrent tool calls queue up here
+        self.lock = asyncio.Lock()
+
+    async def _has_shell_v2(self) -> bool:
+        """Check if the device supports shell_v2, which keeps stderr apart from stdout."""
+        process = await asyncio.create_subprocess_exec(
+            "adb", "features",
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL
+        )
+        try:
+            stdout, _ = await asyncio.wait_for(process.communicate(), 5)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            return True
+        if process.returncode != 0:
+            # No device yet, adb shell reports the error itself
+            return True
+        return "shell_v2" in stdout.decode(errors="replace").split()
+
+    async def _start(self):
+        # Without shell_v2 (Android < 7.0) device stderr arrives on adb's stdout,
+        # so a marker echoed to stderr would never show up on adb's stderr
+        self.split_stderr = await self._has_shell_v2()
+        self.process = await asyncio.create_subprocess_exec(
+            "adb", "shell",
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            limit=16 * 1024 * 1024
+        )
+
+    async def _read_until_marker(self, stream: asyncio.StreamReader, marker: str) -> str:
+        """Read from stream up to and including the marker line."""
+        try:
+            data = await stream.readuntil(marker.encode())
+            data += await stream.readline()
+        except asyncio.IncompleteReadError as e:
+            # The shell exited, keep what it wrote (e.g. adb's "no devices" error)
+            raise EOFError(e.partial.decode(errors="replace"))
+        return data.decode(errors="replace")
+
+    async def _write(self, script: bytes):
+        self.process.stdin.write(script)
+        await self.process.stdin.drain()
+
+    async def _reap_exited(self):
+        """Forget a shell that is exiting on its own and wait for it."""
+        process, self.process = self.process, None
+        try:
+            await asyncio.wait_for(process.wait(), 5)
+        except asyncio.TimeoutError:
+            # Closed its pipes but kept running
+            process.kill()
+            await process.wait()
+
+    def _script(self, command: str, marker: str) -> bytes:
+        """Wrap a command so its end and exit code are marked on stdout (and stderr)."""
+        # Each command runs in a subshell, so `cd`, variables and `exit` don't
+        # leak into later calls, with /dev/null as stdin so it can't swallow them
+        script = f"( {command}\n) </dev/null; echo {marker}$?"
+        if self.split_stderr:
+            script += f"; echo {marker} >&2"
+        return (script + "\n").encode()
+
+    async def run(self, command: str, timeout: float = 30) -> Dict[str, Any]:
+        """Run a command on the device shell and return its output and exit code."""
+        # A fresh marker per call, so command output can never be mistaken for it
+        marker = f"{self.MARKER}{uuid.uuid4().hex}_"
+
+        async with self.lock:
+            # Respawn if the shell was never started or has died (e.g. device reconnected)
+            if self.process is None or self.process.returncode is not None:
+                await self._start()
+
+            try:
+                await self._write(self._script(command, marker))
+            except (BrokenPipeError, ConnectionResetError):
+                # Died before the command was sent, so it is safe to retry once
+                await self._reap_exited()
+                await self._start()
+                try:
+                    await self._write(self._script(command, marker))
+                except (BrokenPipeError, ConnectionResetError):
+                    # Exited right away, the reads below pick up adb's error
+                    pass
+
+            process = self.process
+            split_stderr = self.split_stderr
+            try:
+                reads = [self._read_until_marker(process.stdout, marker)]
+                if split_stderr:
+                    reads.append(self._read_until_marker(process.stderr, marker))
+                results = await asyncio.wait_for(
+                    asyncio.gather(*reads, return_exceptions=True),
+                    timeout
+                )
+                stdout = results[0]
+                stderr = results[1] if split_stderr else ""
+
+                if isinstance(stdout, EOFError) or isinstance(stderr, EOFError):
+                    # adb shell itself failed (no device, unauthorized, ...)
+                    await self._reap_exited()
+                    if not split_stderr:
+                        # adb's own errors still go to its stderr
+                        stderr = EOFError((await process.stderr.read()).decode(errors="replace"))
+                    return {
+                        "output": str(stdout).strip() if isinstance(stdout, EOFError) else "",
+                        "error": str(stderr).strip() if isinstance(stderr, EOFError) else None,
+                        "returncode": process.returncode or 1
+                    }
+                for result in (stdout, stderr):
+                    if isinstance(result, BaseException):
+                        raise result
+
+                output, _, status = stdout.rpartition(marker)
+                error = stderr.rpartition(marker)[0]
+                returncode = int(status.strip())
+            except BaseException:
+                # The shell is in an unknown state, start over on the next call
+                self.close()
+                await process.wait()
+                raise
+
+        return {
+            "output": output.strip(),
+            "error": error.strip() or None,
+            "returncode": returncode
+        }
+
+    def close(self):
+        """Terminate the shell process if it is running."""
+        if self.process is None:
+            return
+        try:
+            if self.process.returncode is None:
+                self.process.kill()
+            self.process.stdin.close()
+        except (ProcessLookupError, RuntimeError):
+            # Already gone, or the event loop it ran on is closed
+            pass
+        self.process = None
+
+    async def aclose(self):
+        """Terminate the shell process and wait for it to exit."""
+        process = self.process
+        self.close()
+        if process is not None:
+            await process.wait()
+
+
+class AdbTcpShell:
+    """
+    Device shell over the ADB protocol spoken directly to adbd on TCP,
+    using the adb_shell package instead of the local adb binary.
+
+    Has the same run() interface as AdbShell. The protocol returns stdout and
+    stderr together, so the exit code is read from a sentinel marker the same way.
+    """
+
+    MARKER = AdbShell.MARKER
+
+    def __init__(self, host: str, port: int = 5555, key_path: str = "~/.android/adbkey"):
+        self.host = host
+        self.port = port
+        self.key_path = os.path.expanduser(key_path)
+        self.device = None
+        self.lock = asyncio.Lock()
+
+    async def _connect(self):
+        """Connect and authenticate with the adb key, reusing an open connection."""
+        if self.device is not None and self.device.available:
+            return self.device
+
+        with open(self.key_path) as f:
+            private_key = f.read()
+        with open(self.key_path + ".pub") as f:
+            public_key = f.read()
+
+        device = AdbDeviceTcpAsync(self.host, self.port)
+        self.device = device
+        await device.connect(rsa_keys=[PythonRSASigner(public_key, private_key)], auth_timeout_s=5)
+        return device
+
+    async def _with_device(self, action, timeout: float):
+        """
+        Run action(device) with connecting included in the timeout.
+
+        Any failure drops the connection so the next call starts clean, and
+        adb_shell's own timeouts are raised as asyncio.TimeoutError like ours.
+        """
+        async def connect_and_run():
+            return await action(await self._connect())
+
+        async with self.lock:
+            try:
+                return await asyncio.wait_for(connect_and_run(), timeout)
+            except (asyncio.TimeoutError, AdbTimeoutError, TcpTimeoutException) as e:
+                await self.aclose()
+                raise asyncio.TimeoutError(f"ADB TCP timeout after {timeout}s") from e
+            except BaseException:
+                await self.aclose()
+                raise
+
+    async def run(self, command: str, timeout: float = 30) -> Dict[str, Any]:
+        """Run a command on the device shell and return its output and exit code."""
+        marker = f"{self.MARKER}{uuid.uuid4().hex}_"
+
+        output = await self._with_device(
+            lambda device: device.shell(f"( {command}\n); echo {marker}$?", read_timeout_s=timeout),
+            timeout
+        )
+
+        output, _, status = output.rpartition(marker)
+
+        return {
+            "output": output.strip(),
+            "error": None,
+            "returncode": int(status.strip() or 1)
+        }
+
+    async def install(self, apk_file: str, timeout: float) -> Dict[str, Any]:
+        """Push an APK to the device and install it with pm."""
+        remote_path = f"/data/local/tmp/{os.path.basename(apk_file)}"
+
+        await self._with_device(lambda device: device.push(apk_file, remote_path), timeout)
+
+        quoted_path = shlex.quote(remote_path)
+        return await self.run(
+            f"pm install -r {quoted_path}; status=$?; rm -f {quoted_path}; exit $status",
+            timeout
+        )
+
+    async def aclose(self):
+        """Close the connection, the next command reconnects."""
+        device, self.device = self.device, None
+        if device is not None:
+            try:
+                await device.close()
+            except Exception:
+                # Broken connections can fail to close cleanly, it is dropped either way
+                pass
+
+
+# ADB_TCP_HOST (and optionally ADB_TCP_PORT) switches shell commands to ADB TCP
+if os.environ.get("ADB_TCP_HOST"):
+    if AdbDeviceTcpAsync is None:
+        raise ImportError("ADB_TCP_HOST is set but adb_shell is missing. Install: pip install 'adb-shell[async]'")
+    device_shell = AdbTcpShell(os.environ["ADB_TCP_HOST"], int(os.environ.get("ADB_TCP_PORT", 5555)))
+else:
+    device_shell = AdbShell()
+    # Backup for exits that skip main(), the adb process would outlive us otherwise
+    atexit.register(device_shell.close)
+
+# Seconds to wait per command, matched by the longest prefix of up to three
+# words, so quick queries against a hung device fail fast instead of stalling the agent
+ADB_TIMEOUTS = {
+    "devices": 3,
+    "get-state": 2,
+    "shell getprop": 3,
+    "shell am instrument": 600,
+    "install": 120,
+    "install-multiple": 120,
+    "shell pm install": 120,
+    "push": 120,
+    "pull": 120,
+}
+ADB_DEFAULT_TIMEOUT = 10
+
+
+def _get_adb_timeout(command: str) -> float:
+    """Timeout for an ADB command, see ADB_TIMEOUTS."""
+    try:
+        # Quoted shell commands ('shell "pm install ..."') count by their words too
+        parts = " ".join(shlex.split(command)).split()
+    except ValueError:
+        parts = command.split()
+    for length in (3, 2, 1):
+        key = " ".join(parts[:length])
+        if len(parts) >= length and key in ADB_TIMEOUTS:
+            return ADB_TIMEOUTS[key]
+    return ADB_DEFAULT_TIMEOUT
+
+
+async def run_adb_command(command: str) -> Dict[str, Any]:
     """
     Execute any ADB command.
     Examples:
     - "devices" - check connected devices
     - "shell pm list packages" - list all packages
     - Your automation test commands
+
+    `shell ...` commands are sent to a persistent `adb shell` process (or
+    an ADB TCP connection, see device_shell), everything else spawns a new
+    `adb` process.
     """
+    timeout = _get_adb_timeout(command)
+
     try:
-        result = subprocess.run(
-            f'adb  {command}',
-            capture_output=True,
-            text=True,
-            timeout=30,
-            shell=True
+        # adb is executed directly, without a local /bin/sh in between
+        try:
+            args = ["adb", *shlex.split(command)]
+        except ValueError as e:
+            return {"error": f"Invalid command: {str(e)}"}
+
+        if len(args) > 2 and args[1] == "shell":
+            # Like adb itself, the device shell gets the arguments joined with spaces
+            result = await device_shell.run(" ".join(args[2:]), timeout)
+
+            return {
+                "command": f"adb {command}",
+                "output": result["output"],
+                "error": result["error"],
+                "success": result["returncode"] == 0
+            }
+
+        process = await asyncio.create_subprocess_exec(
+            *args,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
         )
 
+        try:
+            stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            raise
+
+        return {
+            "command": shlex.join(args),
+            "output": stdout.decode(errors="replace").strip(),
+            "error": stderr.decode(errors="replace").strip() or None,
+            "success": process.returncode == 0
+        }
+    except asyncio.TimeoutError:
+        # Reported separately so the model can retry or check the device
         return {
             "command": f"adb {command}",
-            "output": result.stdout.strip(),
-            "error": result.stderr.strip() if result.stderr else None,
-            "success": result.returncode == 0
+            "error": f"ADB command timed out after {timeout}s - check device connection",
+            "timeout": True,
+            "success": False
         }
     except Exception as e:
         return {"error": f"Failed to run command: {str(e)}"}
@@ -35,13 +396,130 @@ def run_adb_command(command: str) -> Dict[str, Any]:
 
 # ============= TOOL 2: Download and Install Latest Build =============
 
-def get_and_install_latest_build(
+# Shared across tool calls so connections to dev.azure.com stay alive
+_http_client = None
+
+# Latest build per (organization, project, pipeline_id, branch) together with
+# the conditional request headers used to revalidate it
+_build_cache: Dict[tuple, tuple[Dict[str, str], Dict[str, Any]]] = {}
+
+
+def _get_http_client():
+    """Return the shared HTTP/2 client, creating it on first use."""
+    global _http_client
+
+    if _http_client is None or _http_client.is_closed:
+        # All requests to dev.azure.com are multiplexed over one HTTP/2 connection.
+        # Agent iterations can take a while, keep it open between tool calls
+        _http_client = httpx.AsyncClient(
+            http2=True,
+            follow_redirects=True,
+            limits=httpx.Limits(keepalive_expiry=300)
+        )
+    return _http_client
+
+
+async def close_http_client():
+    """Close the shared HTTP client if it was opened."""
+    if _http_client is not None and not _http_client.is_closed:
+        await _http_client.aclose()
+
+
+async def _get_apk_package(apk_file: str) -> Optional[str]:
+    """Read the package name of an APK with aapt, None if aapt isn't available."""
+    if shutil.which("aapt") is None:
+        return None
+
+    process = await asyncio.create_subprocess_exec(
+        "aapt", "dump", "badging", apk_file,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.DEVNULL
+    )
+    stdout, _ = await process.communicate()
+
+    match = re.search(r"package: name='([^']+)'", stdout.decode(errors="replace"))
+    return match.group(1) if match else None
+
+
+async def _get_installed_apk_sha256(package_name: str) -> Optional[str]:
+    """SHA-256 of the APK installed on the device for a package, None if not installed."""
+    device_command = (
+        f"path=$(pm path {shlex.quote(package_name)} | head -n 1 | cut -d: -f2) "
+        f"&& [ -n \"$path\" ] && sha256sum \"$path\""
+    )
+    # Quoted once more, run_adb_command strips one level of quotes like adb does
+    result = await run_adb_command(f"shell {shlex.quote(device_command)}")
+    if not result.get("success") or not result.get("output"):
+        return None
+    return result["output"].split()[0]
+
+
+def _sha256_file(path: str) -> str:
+    """SHA-256 of a local file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _writev_all(fd: int, buffers: List[bytes]):
+    """Write all buffers to fd, one writev() call per batch where available."""
+    if not hasattr(os, "writev"):
+        for buffer in buffers:
+            os.write(fd, buffer)
+        return
+
+    views = [memoryview(buffer) for buffer in buffers]
+    while views:
+        written = os.writev(fd, views)
+        # Drop what was written, a short write can end in the middle of a buffer
+        while views and written >= len(views[0]):
+            written -= len(views[0])
+            views.pop(0)
+        if written:
+            views[0] = views[0][written:]
+
+
+async def _download_to_file(response, path: str, chunk_size: int = 1 << 20, batch_size: int = 16):
+    """
+    Stream a response body into a file.
+
+    Chunks are written in batches of batch_size with a single writev() on a
+    worker thread, so the disk write of one batch overlaps receiving the next.
+    """
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    pending = None
+    try:
+        batch = []
+        async for chunk in response.aiter_bytes(chunk_size):
+            batch.append(chunk)
+            if len(batch) == batch_size:
+                if pending:
+                    await pending
+                pending = asyncio.ensure_future(asyncio.to_thread(_writev_all, fd, batch))
+                batch = []
+
+        if pending:
+            await pending
+            pending = None
+        if batch:
+            await asyncio.to_thread(_writev_all, fd, batch)
+    finally:
+        # Never close the fd while a worker thread may still be writing to it
+        if pending:
+            await asyncio.gather(pending, return_exceptions=True)
+        os.close(fd)
+
+
+async def get_and_install_latest_build(
     organization: str,
     project: str,
     pipeline_id: str,
     pat_token: str,
     artifact_name: str = "drop",
-    branch: str = "refs/heads/main"
+    branch: str = "refs/heads/main",
+    package_name: Optional[str] = None
 ) -> Dict[str, Any]:
     """
     Get the latest successful build from specified branch and install it via ADB.
@@ -49,7 +527,8 @@ def get_and_install_latest_build(
     Steps:
     1. Query Azure DevOps for latest successful build from branch
     2. Download the build artifact (APK)
-    3. Install via ADB to connected device
+    3. Install via ADB to connected device, skipped if the device already
+       has an identical APK installed
 
     Args:
         organization: Azure DevOps organization name
@@ -58,16 +537,14 @@ def get_and_install_latest_build(
         pat_token: Personal Access Token for authentication
         artifact_name: Name of the artifact containing APK (default: "drop")
         branch: Branch name (default: "refs/heads/main")
+        package_name: Application package id, read from the APK with aapt if not given
 
     Returns: Installation status with build info
     """
-    try:
-        import requests
-        from base64 import b64encode
-        import tempfile
-        import os
-        import zipfile
+    if httpx is None:
+        return {"error": "Missing dependency. Install: pip install 'httpx[http2]'"}
 
+    try:
         # Step 1: Get latest successful build from branch
         url = f"https://dev.azure.com/{organization}/{project}/_apis/build/builds"
         params = {
@@ -84,15 +561,33 @@ def get_and_install_latest_build(
             "Content-Type": "application/json"
         }
 
-        response = requests.get(url, params=params, headers=headers, timeout=10)
+        # Revalidate the cached latest build instead of fetching it again
+        cache_key = (organization, project, pipeline_id, branch)
+        cached = _build_cache.get(cache_key)
+
+        client = _get_http_client()
+
+        build_headers = {**headers, **cached[0]} if cached else headers
+
+        response = await client.get(url, params=params, headers=build_headers, timeout=10)
 
-        if response.status_code != 200:
+        if response.status_code == 304 and cached:
+            data = {"value": [cached[1]]}
+        elif response.status_code != 200:
             return {
                 "error": f"Failed to get builds: {response.status_code}",
                 "details": response.text
             }
+        else:
+            data = response.json()
 
-        data = response.json()
+            validators = {}
+            if response.headers.get("ETag"):
+                validators["If-None-Match"] = response.headers["ETag"]
+            if response.headers.get("Last-Modified"):
+                validators["If-Modified-Since"] = response.headers["Last-Modified"]
+            if validators and data.get("value"):
+                _build_cache[cache_key] = (validators, data["value"][0])
 
         if not data.get("value"):
             return {"error": f"No successful builds found for branch {branch}"}
@@ -105,7 +600,7 @@ def get_and_install_latest_build(
         artifact_url = f"https://dev.azure.com/{organization}/{project}/_apis/build/builds/{build_id}/artifacts"
         artifact_params = {"artifactName": artifact_name, "api-version": "7.0"}
 
-        artifact_response = requests.get(artifact_url, params=artifact_params, headers=headers, timeout=10)
+        artifact_response = await client.get(artifact_url, params=artifact_params, headers=headers, timeout=10)
 
         if artifact_response.status_code != 200:
             return {
@@ -127,32 +622,25 @@ def get_and_install_latest_build(
         if not download_url:
             return {"error": "Download URL not found in artifact response"}
 
-        # Step 3: Download artifact
-        download_response = requests.get(download_url, headers=headers, timeout=60)
-
-        if download_response.status_code != 200:
-            return {"error": f"Failed to download artifact: {download_response.status_code}"}
-
-        # Step 4: Save and extract artifact
         with tempfile.TemporaryDirectory() as temp_dir:
+            # Step 3: Download artifact straight to disk
             zip_path = os.path.join(temp_dir, "artifact.zip")
 
-            with open(zip_path, "wb") as f:
-                f.write(download_response.content)
+            # httpx timeouts apply per read, not to the whole transfer
+            async with client.stream("GET", download_url, headers=headers, timeout=60) as download_response:
+                if download_response.status_code != 200:
+                    return {"error": f"Failed to download artifact: {download_response.status_code}"}
 
-            # Extract APK
-            with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-                zip_ref.extractall(temp_dir)
+                # Write the artifact in chunks instead of holding the whole ZIP in memory
+                await _download_to_file(download_response, zip_path)
 
-            # Find APK file
+            # Step 4: Extract only the APK, picking the largest one if there are several
             apk_file = None
-            for root, _, files in os.walk(temp_dir):
-                for file in files:
-                    if file.endswith('.apk'):
-                        apk_file = os.path.join(root, file)
-                        break
-                if apk_file:
-                    break
+            with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+                apk_names = [n for n in zip_ref.namelist() if n.endswith('.apk')]
+                if apk_names:
+                    apk_name = max(apk_names, key=lambda n: zip_ref.getinfo(n).file_size)
+                    apk_file = zip_ref.extract(apk_name, temp_dir)
 
             if not apk_file:
                 return {
@@ -161,34 +649,114 @@ def get_and_install_latest_build(
                     "downloaded": True
                 }
 
-            # Step 5: Install via ADB
-            install_result = subprocess.run(
-                f'adb install -r "{apk_file}"',
-                capture_output=True,
-                text=True,
-                timeout=60,
-                shell=True
-            )
+            # Step 5: Skip the install if the device already has this exact APK
+            package_name = package_name or await _get_apk_package(apk_file)
+            installed_sha256 = await _get_installed_apk_sha256(package_name) if package_name else None
+
+            if installed_sha256 and installed_sha256 == await asyncio.to_thread(_sha256_file, apk_file):
+                return {
+                    "success": True,
+                    "skipped": True,
+                    "reason": "already installed",
+                    "build_id": build_id,
+                    "build_number": build_number,
+                    "branch": branch,
+                    "apk_file": os.path.basename(apk_file),
+                    "package_name": package_name,
+                    "web_url": latest_build.get("_links", {}).get("web", {}).get("href")
+                }
+
+            # Step 6: Install via ADB
+            if isinstance(device_shell, AdbTcpShell):
+                install_result = await device_shell.install(apk_file, ADB_TIMEOUTS["install"])
+            else:
+                # Fast deploy only pushes the changed parts of an APK and needs
+                # a previous version of the app on the device
+                install_args = ["adb", "install", "-r"]
+                if installed_sha256:
+                    install_args.append("--fastdeploy")
+                install_args.append(apk_file)
+
+                install_process = await asyncio.create_subprocess_exec(
+                    *install_args,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE
+                )
+
+                try:
+                    install_output, install_error = await asyncio.wait_for(
+                        install_process.communicate(), ADB_TIMEOUTS["install"]
+                    )
+                except asyncio.TimeoutError:
+                    install_process.kill()
+                    await install_process.wait()
+                    raise
+
+                install_result = {
+                    "output": install_output.decode(errors="replace").strip(),
+                    "error": install_error.decode(errors="replace").strip() or None,
+                    "returncode": install_process.returncode
+                }
 
             return {
-                "success": install_result.returncode == 0,
+                "success": install_result["returncode"] == 0,
                 "build_id": build_id,
                 "build_number": build_number,
                 "branch": branch,
                 "apk_file": os.path.basename(apk_file),
-                "install_output": install_result.stdout.strip(),
-                "install_error": install_result.stderr.strip() if install_result.stderr else None,
+                "install_output": install_result["output"],
+                "install_error": install_result["error"],
                 "web_url": latest_build.get("_links", {}).get("web", {}).get("href")
             }
 
-    except ImportError:
-        return {"error": "Missing dependency. Install: pip install requests"}
-    except subprocess.TimeoutExpired:
-        return {"error": "ADB install timeout - check device connection"}
+    except asyncio.TimeoutError:
+        return {"error": "ADB install timeout - check device connection", "timeout": True}
     except Exception as e:
         return {"error": f"Failed to download and install: {str(e)}"}
 
 
+# ============= TOOL 3: Run a Batch of ADB Commands =============
+
+async def run_adb_batch(commands: List[str], validate_after: bool = False) -> Dict[str, Any]:
+    """
+    Execute several ADB commands in one tool call.
+
+    Commands run in order through run_adb_command (so `shell ...` commands
+    reuse the persistent shell) and the batch stops at the first failure.
+
+    Args:
+        commands: ADB commands without 'adb' prefix
+        validate_after: Also report the focused window once the batch is done
+
+    Returns: Result of every executed command
+    """
+    # Models sometimes send a single command as a plain string
+    if isinstance(commands, str):
+        commands = [commands]
+    if not isinstance(commands, list) or not all(isinstance(c, str) for c in commands):
+        return {"error": "commands must be a list of ADB command strings", "success": False}
+
+    results = []
+    for command in commands:
+        result = await run_adb_command(command)
+        results.append(result)
+        if not result.get("success"):
+            break
+
+    batch = {
+        "results": results,
+        "success": len(results) == len(commands) and all(r.get("success") for r in results)
+    }
+
+    if len(results) < len(commands):
+        batch["skipped"] = commands[len(results):]
+
+    if validate_after:
+        batch["focused_window"] = await run_adb_command("shell dumpsys window | grep mCurrentFocus")
+
+    return batch
+
+
 # ============= TOOL DEFINITIONS =============
 
 tools = [
@@ -240,32 +808,104 @@ tools = [
                     "branch": {
                         "type": "string",
                         "description": "Branch name to get build from (default: 'refs/heads/main')",
+                    },
+                    "package_name": {
+                        "type": "string",
+                        "description": "Android package id of the app (e.g., 'com.mycompany.app'), used to skip the install when the same build is already on the device",
                     }
                 },
                 "required": ["organization", "project", "pipeline_id", "pat_token"],
             },
         },
     },
+    {
+        "type": "function",
+        "function": {
+            "name": "run_adb_batch",
+            "description": "Run several ADB commands in order in one step, stopping at the first failure. Prefer this over run_adb_command whenever more than one deterministic step is needed (e.g. press HOME, launch app, tap, type text).",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "commands": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": "ADB commands without 'adb' prefix, in execution order. Example: ['shell input keyevent KEYCODE_HOME', 'shell monkey -p com.example.app 1', 'shell input tap 500 800']",
+                    },
+                    "validate_after": {
+                        "type": "boolean",
+                        "description": "Report the currently focused window after the batch to verify the resulting screen (default: false)",
+                    }
+                },
+                "required": ["commands"],
+            },
+        },
+    },
 ]
 
 available_functions = {
     "run_adb_command": run_adb_command,
     "get_and_install_latest_build": get_and_install_latest_build,
+    "run_adb_batch": run_adb_batch,
 }
 
 
+async def call_tool(name: str, arguments: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Run one tool call from the model.
+
+    Failures are returned as an error result, so one bad call (unknown tool,
+    wrong arguments) doesn't abort the other calls running next to it.
+    """
+    func = available_functions.get(name)
+    if func is None:
+        return {"error": f"Unknown tool: {name}"}
+
+    try:
+        return await func(**arguments)
+    except Exception as e:
+        return {"error": f"Tool {name} failed: {str(e)}"}
+
+
 # ============= REACT AGENT =============
 
+# Print full, pretty-printed tool results instead of a shortened preview
+DEBUG = os.environ.get("AGENT_DEBUG") == "1"
+
+# Sent as the first message of every conversation and never changed, so together
+# with the tool schemas it forms a stable prefix Ollama can keep in its KV cache
+STATIC_SYSTEM_PROMPT = """You are an Android automation testing assistant.
+You check connected devices, install builds from Azure DevOps and drive apps through ADB.
+Use the tools to act and answer from their results, don't guess device state.
+Prefer run_adb_batch over run_adb_command when more than one deterministic step is needed."""
+
 class AndroidReactAgent:
     """Simple ReAct agent for Android automation testing."""
 
     def __init__(self, model: str = "gpt-oss:20b"):
         self.model = model
         self.max_iterations = 10
+        # How long Ollama keeps the model loaded after the last request
+        self.keep_alive = "30m"
+        # Room for the system prompt, tool schemas and tool results of all iterations
+        self.num_ctx = 8192
+        self.client = AsyncClient()
+
+    async def warm_up(self):
+        """Load the model into memory before the first query."""
+        await self.client.generate(
+            model=self.model,
+            prompt="",
+            keep_alive=self.keep_alive,
+            options={"num_ctx": self.num_ctx},
+        )
 
-    def run(self, user_query: str) -> str:
+    async def run(self, user_query: str) -> str:
         """Run the ReAct loop."""
-        messages = [{"role": "user", "content": user_query}]
+        # Messages are only ever appended, earlier turns stay a cacheable prefix
+        messages = [
+            {"role": "system", "content": STATIC_SYSTEM_PROMPT},
+            {"role": "user", "content": user_query},
+        ]
         iteration = 0
 
         print(f"\n{'='*50}")
@@ -276,67 +916,114 @@ class AndroidReactAgent:
             iteration += 1
             print(f"\n--- Iteration {iteration} ---")
 
-            response: ChatResponse = chat(
-                self.model,
-                messages=messages,
-                tools=tools,
-            )
+            thinking = ""
+            content = ""
+            tool_calls = []
+            tasks = []
 
-            if response.message.tool_calls:
-                # Add assistant message
-                messages.append(response.message)
+            try:
+                # Stream the reply, text is printed as it arrives and tools start
+                # as soon as their call is complete instead of after the whole message
+                chunk: ChatResponse
+                async for chunk in await self.client.chat(
+                    self.model,
+                    messages=messages,
+                    tools=tools,
+                    stream=True,
+                    keep_alive=self.keep_alive,
+                    options={"num_ctx": self.num_ctx},
+                ):
+                    # gpt-oss reasons before answering, show that as it streams too
+                    if chunk.message.thinking:
+                        if not thinking:
+                            print("Thinking: ", end="")
+                        thinking += chunk.message.thinking
+                        print(chunk.message.thinking, end="", flush=True)
+
+                    if chunk.message.content:
+                        if thinking and not content:
+                            print("\n")
+                        content += chunk.message.content
+                        print(chunk.message.content, end="", flush=True)
 
-                # Execute tools
-                for tool_call in response.message.tool_calls:
-                    func_name = tool_call.function.name
-                    func_args = tool_call.function.arguments
+                    for tool_call in chunk.message.tool_calls or []:
+                        if not tool_calls and (thinking or content):
+                            print()
+                        print(f"Tool: {tool_call.function.name}({tool_call.function.arguments})")
 
-                    print(f"Tool: {func_name}({func_args})")
+                        tool_calls.append(tool_call)
+                        tasks.append(asyncio.create_task(
+                            call_tool(tool_call.function.name, tool_call.function.arguments)
+                        ))
+            except BaseException:
+                for task in tasks:
+                    task.cancel()
+                raise
 
-                    func = available_functions[func_name]
-                    result = func(**func_args)
+            if tool_calls:
+                # Add assistant message
+                messages.append(Message(
+                    role="assistant",
+                    content=content,
+                    thinking=thinking or None,
+                    tool_calls=tool_calls,
+                ))
+
+                # Independent calls from one turn run concurrently, results keep call order
+                results = await asyncio.gather(*tasks)
+
+                for result in results:
+                    # Serialized once, the compact form goes to the model
+                    result_json = json.dumps(result, separators=(",", ":"))
 
-                    print(f"Result: {json.dumps(result, indent=2)}\n")
+                    if DEBUG:
+                        print(f"Result: {json.dumps(result, indent=2)}\n")
+                    else:
+                        preview = result_json if len(result_json) <= 500 else result_json[:500] + "…"
+                        print(f"Result: {preview}\n")
 
                     # Add tool response
                     messages.append({
                         "role": "tool",
-                        "content": json.dumps(result),
+                        "content": result_json,
                     })
                 continue
 
             else:
-                # Final answer
-                answer = response.message.content
-                print(f"\n{'='*50}")
-                print(f"Answer: {answer}")
-                print(f"{'='*50}\n")
-                return answer
+                # Final answer, already printed while streaming
+                print(f"\n{'='*50}\n")
+                return content
 
         return "Error: Max iterations reached"
 
 
 # ============= EXAMPLES =============
 
-def main():
+async def main():
     agent = AndroidReactAgent()
 
-    # Example 1: Check devices
-    agent.run("What devices are connected?")
+    try:
+        await agent.warm_up()
+
+        # Example 1: Check devices
+        await agent.run("What devices are connected?")
 
-    # Example 2: Download and install latest build from main branch
-    # Note: Replace with your actual Azure DevOps details
-    agent.run("""
-        Download and install the latest successful build from main branch.
-        Organization: myorg
-        Project: MyProject
-        Pipeline ID: 123
-        PAT Token: your_pat_token_here
-        Artifact name: drop
-    """)
+        # Example 2: Download and install latest build from main branch
+        # Note: Replace with your actual Azure DevOps details
+        await agent.run("""
+            Download and install the latest successful build from main branch.
+            Organization: myorg
+            Project: MyProject
+            Pipeline ID: 123
+            PAT Token: your_pat_token_here
+            Artifact name: drop
+        """)
+    finally:
+        await device_shell.aclose()
+        await close_http_client()
 
 
 if __name__ == "__main__":
     print("Android Automation ReAct Agent")
-    print("Requirements: ollama with gpt-oss:20b, adb, pip install requests\n")
-    main()
+    print("Requirements: ollama with gpt-oss:20b, adb, pip install 'httpx[http2]'\n")
+    asyncio.run(main())